@@ -0,0 +1,275 @@
+import pyodbc
+import logging
+import time
+import json
+from datetime import datetime, date
+import os
+from dotenv import load_dotenv
+import argparse
+
+# Load environment variables
+load_dotenv()
+
+# Database configuration from environment variables
+DB_CONFIG = {
+    'driver': os.getenv('DB_DRIVER', 'SQL Server'),  # 'ODBC Driver 17 for SQL Server' for fast_executemany support
+    'server': os.getenv('DB_SERVER'),
+    'database': os.getenv('DB_NAME'),
+    'trusted_connection': os.getenv('DB_TRUSTED_CONNECTION', 'yes'),
+    'uid': os.getenv('DB_USERNAME'),  # Will be None if not set
+    'pwd': os.getenv('DB_PASSWORD')   # Will be None if not set
+}
+_DB_CONNECTION = None  # Opened lazily and reused by get_database_connection()
+_INDEXED_COLUMNS = set()  # (table, column) pairs already checked by ensure_unique_index()
+
+# Ranges synced successfully within this many minutes are skipped (0 disables the check)
+SYNC_FRESHNESS_MINUTES = float(os.getenv('SYNC_FRESHNESS_MINUTES', '10'))
+SYNC_STATE_FILE = os.getenv('SYNC_STATE_FILE', 'sync_state.json')
+
+# Number of rows staged and merged per round-trip
+BATCH_SIZE = 10000
+
+# Minimum number of seconds between progress messages
+PROGRESS_INTERVAL = 0.5
+
+# Any index whose first key column is the given column already lets the upsert seek on it
+INDEX_EXISTS_SQL = """
+SELECT 1
+FROM sys.indexes AS i
+JOIN sys.index_columns AS ic ON ic.object_id = i.object_id AND ic.index_id = i.index_id
+JOIN sys.columns AS c ON c.object_id = ic.object_id AND c.column_id = ic.column_id
+WHERE i.object_id = OBJECT_ID(?) AND ic.key_ordinal = 1 AND c.name = ?
+"""
+
+def configure_logging(filename):
+    """Send log records to the given file"""
+    logging.basicConfig(
+        filename=filename,
+        level=logging.INFO,
+        format='%(asctime)s - %(levelname)s - %(message)s'
+    )
+
+def get_database_connection():
+    """Return the shared database connection, reconnecting if it was dropped
+
+    Reuse only saves a login for callers running several syncs in one process;
+    the CLI scripts sync once per invocation.
+    """
+    global _DB_CONNECTION
+    try:
+        if _DB_CONNECTION is not None:
+            try:
+                probe = _DB_CONNECTION.execute("SELECT 1")
+                probe.fetchone()
+                probe.close()
+                return _DB_CONNECTION
+            except pyodbc.Error:
+                logging.warning("Database connection lost, reconnecting")
+                try:
+                    _DB_CONNECTION.close()
+                except pyodbc.Error:
+                    pass
+                _DB_CONNECTION = None
+
+        conn_str = (
+            f"DRIVER={{{DB_CONFIG['driver']}}};"
+            f"SERVER={DB_CONFIG['server']};"
+            f"DATABASE={DB_CONFIG['database']};"
+            f"Trusted_Connection={DB_CONFIG['trusted_connection']};"
+        )
+        # Keep all batches in one transaction committed once by upsert_rows
+        _DB_CONNECTION = pyodbc.connect(conn_str, autocommit=False)
+        # Suppress row-count messages for every statement on this session
+        _DB_CONNECTION.execute("SET NOCOUNT ON")
+        return _DB_CONNECTION
+    except Exception as e:
+        logging.error(f"Database connection error: {str(e)}")
+        raise
+
+def ensure_unique_index(conn, table, column):
+    """Create a unique index on table(column) unless an index already leads with it"""
+    if (table, column) in _INDEXED_COLUMNS:
+        return
+
+    cursor = conn.cursor()
+    try:
+        cursor.execute(INDEX_EXISTS_SQL, (table, column))
+        if cursor.fetchone() is None:
+            print(f"Creating unique index on {table}({column})...")
+            cursor.execute(f"CREATE UNIQUE INDEX IX_{table}_{column} ON {table} ({column})")
+            conn.commit()
+            logging.info(f"Created unique index IX_{table}_{column}")
+        _INDEXED_COLUMNS.add((table, column))
+    except pyodbc.Error as e:
+        # The index only speeds up the upsert, so a failure (e.g. existing duplicates) shouldn't stop the sync
+        conn.rollback()
+        logging.warning(f"Could not create unique index on {table}({column}): {str(e)}")
+    finally:
+        cursor.close()
+
+def resolve_date_range(start_date=None, end_date=None):
+    """Default missing dates to today and drop any time component"""
+    # If no dates provided, use today's date
+    if start_date is None:
+        start_date = date.today()
+    if end_date is None:
+        end_date = date.today()
+
+    # Drop any time component so the same day always produces the same query
+    if isinstance(start_date, datetime):
+        start_date = start_date.date()
+    if isinstance(end_date, datetime):
+        end_date = end_date.date()
+
+    return start_date, end_date
+
+def load_sync_state():
+    """Read the last successful sync times, keyed by job and date range"""
+    try:
+        with open(SYNC_STATE_FILE) as f:
+            state = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    # Anything other than a JSON object is treated as no recorded syncs
+    return state if isinstance(state, dict) else {}
+
+def is_recently_synced(job, start_date, end_date):
+    """Check whether this job already synced the same range within SYNC_FRESHNESS_MINUTES"""
+    if SYNC_FRESHNESS_MINUTES <= 0:
+        return False
+
+    last_synced = load_sync_state().get(f"{job}:{start_date}:{end_date}")
+    if not isinstance(last_synced, (int, float)):
+        return False
+    return time.time() - last_synced < SYNC_FRESHNESS_MINUTES * 60
+
+def mark_synced(job, start_date, end_date):
+    """Record a successful sync of the range for is_recently_synced()"""
+    now = time.time()
+    # Drop entries too old to skip a sync so the file doesn't grow with every range ever synced
+    state = {
+        key: synced_at for key, synced_at in load_sync_state().items()
+        if isinstance(synced_at, (int, float)) and now - synced_at < SYNC_FRESHNESS_MINUTES * 60
+    }
+    state[f"{job}:{start_date}:{end_date}"] = now
+    try:
+        with open(SYNC_STATE_FILE, 'w') as f:
+            json.dump(state, f)
+    except OSError as e:
+        logging.warning(f"Could not write sync state: {str(e)}")
+
+def upsert_rows(conn, rows, create_stage_sql, insert_stage_sql, update_sql, insert_sql):
+    """Stage rows in #stage batch by batch and apply them to the target table"""
+    cursor = conn.cursor()
+    # Bind parameters as arrays so executemany ships each batch in a single round-trip
+    cursor.fast_executemany = True
+    total_records = len(rows)
+    try:
+        print(f"\nProcessing {total_records} records...")
+
+        # Stage all rows in a temp table so the upsert runs once per batch instead of once per row
+        cursor.execute(create_stage_sql)
+
+        last_progress = time.monotonic()
+        for start in range(0, total_records, BATCH_SIZE):
+            batch = rows[start:start + BATCH_SIZE]
+            cursor.executemany(insert_stage_sql, batch)
+            # Run as separate statements so an error from either one is raised here
+            cursor.execute(update_sql)
+            cursor.execute(insert_sql)
+            cursor.execute("TRUNCATE TABLE #stage")
+
+            # Report progress at most every PROGRESS_INTERVAL seconds, and always on the last batch
+            processed = start + len(batch)
+            if processed == total_records or time.monotonic() - last_progress >= PROGRESS_INTERVAL:
+                last_progress = time.monotonic()
+                progress = (processed / total_records) * 100
+                print(f"Progress: {progress:.1f}% ({processed}/{total_records} records)")
+
+        cursor.execute("DROP TABLE #stage")
+
+        print("\nCommitting changes to database...")
+        conn.commit()
+        print("✓ Database update completed successfully")
+        logging.info(f"Successfully processed {total_records} records")
+    except Exception as e:
+        conn.rollback()
+        logging.error(f"Data insertion error: {str(e)}")
+        raise
+    finally:
+        cursor.close()
+
+def run_sync(job, fetch_fn, insert_fn, key_table, key_column, start_date=None, end_date=None,
+             force=False, on_success=None, on_error=None):
+    """Fetch a date range with fetch_fn and upsert it into key_table with insert_fn
+
+    on_success(start_date, end_date, records_processed) and
+    on_error(start_date, end_date, error_message, records_processed) are
+    optional hooks called once the sync finishes. force=True ignores the
+    recently-synced check.
+    """
+    records_processed = 0
+    try:
+        start_date, end_date = resolve_date_range(start_date, end_date)
+
+        print(f"\n=== Starting {job} Data Sync Process ===")
+        print(f"Date range: {start_date} to {end_date}")
+
+        # A reversed range can't contain any records
+        if start_date > end_date:
+            print("✗ Start date is after end date, nothing to sync")
+            logging.warning(f"{job} data sync skipped, start date {start_date} is after end date {end_date}")
+            return
+
+        # Skip the fetch and upsert when the same range was synced moments ago
+        if not force and is_recently_synced(job, start_date, end_date):
+            print("✓ Date range already synced recently, nothing to do (use --force to sync anyway)")
+            logging.warning(f"{job} data sync skipped, period {start_date} to {end_date} synced recently")
+            return
+
+        data = fetch_fn(start_date, end_date)
+        records_processed = len(data)
+
+        if data:
+            # Connect to database and insert data
+            print("\nConnecting to database...")
+            with get_database_connection() as conn:
+                print("✓ Database connection established")
+                ensure_unique_index(conn, key_table, key_column)
+                insert_fn(conn, data)
+        else:
+            print("No records to insert, skipping database update")
+
+        print(f"\n=== {job} Data Sync Process Completed ===")
+        logging.info(f"{job} data sync completed successfully for period {start_date} to {end_date}")
+        mark_synced(job, start_date, end_date)
+
+        if on_success is not None:
+            on_success(start_date, end_date, records_processed)
+    except Exception as e:
+        error_message = str(e)
+        print(f"\n✗ Error: {job} data sync failed: {error_message}")
+        logging.error(f"{job} data sync failed: {error_message}")
+
+        if on_error is not None:
+            on_error(start_date, end_date, error_message, records_processed)
+
+def run_cli(description, sync_fn):
+    """Parse --start-date/--end-date and run sync_fn for that range"""
+    parser = argparse.ArgumentParser(description=description)
+    parser.add_argument('--start-date', type=str, help='Start date (YYYY-MM-DD)', default=None)
+    parser.add_argument('--end-date', type=str, help='End date (YYYY-MM-DD)', default=None)
+    parser.add_argument('--force', action='store_true', help='Sync even if the range was synced recently')
+
+    args = parser.parse_args()
+
+    try:
+        start_date = datetime.strptime(args.start_date, '%Y-%m-%d').date() if args.start_date else None
+        end_date = datetime.strptime(args.end_date, '%Y-%m-%d').date() if args.end_date else None
+
+        sync_fn(start_date, end_date, force=args.force)
+    except ValueError as e:
+        logging.error(f"Invalid date format. Please use YYYY-MM-DD. Error: {str(e)}")
+        print("Invalid date format. Please use YYYY-MM-DD")
+    except Exception as e:
+        logging.error(f"Error in main: {str(e)}")
@@ -1,79 +1,143 @@
 import requests
-import pyodbc
-import time
-from datetime import datetime, date
+import orjson
+import pandas as pd
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import logging
-from dotenv import load_dotenv
 import os
-import argparse
+from datetime import timedelta
+from concurrent.futures import ThreadPoolExecutor
 import smtplib
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
-
-# Load environment variables
-load_dotenv()
+from common import configure_logging, run_cli, run_sync, upsert_rows
 
 # Configure logging
-logging.basicConfig(
-    filename='harvest_data_sync.log',
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s'
-)
-
-# Database configuration from environment variables
-DB_CONFIG = {
-    'server': os.getenv('DB_SERVER'),
-    'database': os.getenv('DB_NAME'),
-    'trusted_connection': os.getenv('DB_TRUSTED_CONNECTION', 'yes'),
-    'uid': os.getenv('DB_USERNAME'),  # Will be None if not set
-    'pwd': os.getenv('DB_PASSWORD')   # Will be None if not set
-}
+configure_logging('harvest_data_sync.log')
 
 # API configuration from environment variables
 API_BASE_URL = os.getenv('API_BASE_URL', 'https://run-api-bi-neo-23393472851.us-central1.run.app')
 API_KEY = os.getenv('API_KEY', 'SN1re5a4#1sd$Q6ARTvPpd<Zop*ObkSN1rPpf')
 
+# Maximum number of per-day API requests in flight during multi-day syncs
+API_MAX_WORKERS = int(os.getenv('API_MAX_WORKERS', '8'))
+
+# Shared HTTP session: keeps the API connection alive between requests and retries transient failures
+API_SESSION = requests.Session()
+API_SESSION.headers.update({
+    'Authorization': f'Bearer {API_KEY}',
+    'x-env': 'prod',
+    'Empresa': 'magopco'
+})
+API_ADAPTER = HTTPAdapter(
+    pool_connections=4,
+    pool_maxsize=16,
+    max_retries=Retry(total=5, backoff_factor=0.5, status_forcelist=[429, 502, 503, 504])
+)
+# Mount for both schemes so an http:// API_BASE_URL (local/staging) keeps retries too
+API_SESSION.mount('https://', API_ADAPTER)
+API_SESSION.mount('http://', API_ADAPTER)
+
 # Email configuration from environment variables
 EMAIL_SENDER = os.getenv('EMAIL_SENDER')
 EMAIL_PASSWORD = os.getenv('EMAIL_APP_PASSWORD')  # Gmail App Password
 EMAIL_RECIPIENT = os.getenv('EMAIL_RECIPIENT')
 SMTP_SERVER = 'smtp.gmail.com'
 SMTP_PORT = 587
-
-def get_database_connection():
-    """Establish database connection"""
-    try:
-        conn_str = (
-            f"DRIVER={{SQL Server}};"
-            f"SERVER={DB_CONFIG['server']};"
-            f"DATABASE={DB_CONFIG['database']};"
-            f"Trusted_Connection={DB_CONFIG['trusted_connection']};"
-        )
-        return pyodbc.connect(conn_str)
-    except Exception as e:
-        logging.error(f"Database connection error: {str(e)}")
-        raise
+# Single background worker for notifications; pending emails are still sent before the process exits
+EMAIL_EXECUTOR = ThreadPoolExecutor(max_workers=1)
+
+# API record fields, in the column order of the staging table
+HARVEST_COLUMNS = [
+    'id', 'farm', 'plot', 'produce', 'worker', 'unit',
+    'harvest_date', 'start_time', 'end_time',
+    'duration', 'containers', 'kgs_harvested'
+]
+
+# SQL statements are kept constant so SQL Server can reuse their cached plans
+CREATE_STAGE_SQL = """
+SELECT TOP 0 id, farm, plot, produce, worker, unit,
+       harvest_date, start_time, end_time,
+       duration, containers, kgs_harvested
+INTO #stage
+FROM harvests
+"""
+
+INSERT_STAGE_SQL = """
+INSERT INTO #stage (id, farm, plot, produce, worker, unit,
+                    harvest_date, start_time, end_time,
+                    duration, containers, kgs_harvested)
+VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+"""
+
+# Only rows whose values changed are updated and only new ids are inserted,
+# so re-running an already synced range writes nothing
+UPDATE_SQL = """
+UPDATE target
+SET farm = source.farm,
+    plot = source.plot,
+    produce = source.produce,
+    worker = source.worker,
+    unit = source.unit,
+    harvest_date = source.harvest_date,
+    start_time = source.start_time,
+    end_time = source.end_time,
+    duration = source.duration,
+    containers = source.containers,
+    kgs_harvested = source.kgs_harvested,
+    insert_date = GETDATE()
+FROM harvests AS target
+JOIN #stage AS source ON target.id = source.id
+WHERE EXISTS (
+    SELECT source.farm, source.plot, source.produce, source.worker, source.unit,
+           source.harvest_date, source.start_time, source.end_time,
+           source.duration, source.containers, source.kgs_harvested
+    EXCEPT
+    SELECT target.farm, target.plot, target.produce, target.worker, target.unit,
+           target.harvest_date, target.start_time, target.end_time,
+           target.duration, target.containers, target.kgs_harvested
+)
+"""
+
+INSERT_SQL = """
+INSERT INTO harvests (id, farm, plot, produce, worker, unit, 
+                      harvest_date, start_time, end_time, 
+                      duration, containers, kgs_harvested, insert_date)
+SELECT source.id, source.farm, source.plot, source.produce,
+       source.worker, source.unit, source.harvest_date,
+       source.start_time, source.end_time, source.duration,
+       source.containers, source.kgs_harvested, GETDATE()
+FROM #stage AS source
+LEFT JOIN harvests AS target ON target.id = source.id
+WHERE target.id IS NULL
+"""
+
+def fetch_api_range(start_date, end_date):
+    """Fetch the raw API records for a single date range"""
+    params = {
+        'type': 'harvest',
+        'dateStart': start_date.strftime('%Y-%m-%d'),
+        'dateEnd': end_date.strftime('%Y-%m-%d')
+    }
+    
+    url = f"{API_BASE_URL}/api/magopco/get-bi-produccion"
+    response = API_SESSION.get(url, params=params)
+    response.raise_for_status()
+    return orjson.loads(response.content)
 
 def fetch_api_data(start_date, end_date):
-    """Fetch data from API for a date range"""
+    """Fetch data from API for a date range, one concurrent request per day"""
     try:
         print(f"Fetching data from API for period {start_date} to {end_date}...")
-        params = {
-            'type': 'harvest',
-            'dateStart': start_date.strftime('%Y-%m-%d'),
-            'dateEnd': end_date.strftime('%Y-%m-%d')
-        }
+        days = [start_date + timedelta(days=offset) for offset in range((end_date - start_date).days + 1)]
         
-        headers = {
-            'Authorization': f'Bearer {API_KEY}',
-            'x-env': 'prod',
-            'Empresa': 'magopco'
-        }
+        if len(days) <= 1:
+            data = fetch_api_range(start_date, end_date)
+        else:
+            with ThreadPoolExecutor(max_workers=min(API_MAX_WORKERS, len(days))) as executor:
+                daily_data = executor.map(lambda day: fetch_api_range(day, day), days)
+                data = [record for day_data in daily_data for record in day_data]
         
-        url = f"{API_BASE_URL}/api/magopco/get-bi-produccion"
-        response = requests.get(url, headers=headers, params=params)
-        response.raise_for_status()
-        data = response.json()
         print(f"✓ Successfully fetched {len(data)} records from API")
         return data
     except Exception as e:
@@ -83,76 +147,29 @@ def fetch_api_data(start_date, end_date):
 
 def insert_data(conn, data):
     """Insert or update data in database"""
-    cursor = conn.cursor()
-    total_records = len(data)
+    # Keep one record per id, the last one winning, so the upsert never sees duplicate keys
+    data = list({record['id']: record for record in data}.values())
+    
+    # Pivot the records into one list per column, then parse dates/times column-wise
+    cols = {column: [record[column] for record in data] for column in HARVEST_COLUMNS}
+    cols['harvest_date'] = pd.to_datetime(cols['harvest_date'], format='%Y-%m-%d %H:%M:%S', cache=True).strftime('%Y-%m-%d %H:%M:%S').tolist()
+    cols['start_time'] = pd.to_datetime(cols['start_time'], format='%H:%M', cache=True).strftime('%H:%M:%S').tolist()
+    cols['end_time'] = pd.to_datetime(cols['end_time'], format='%H:%M', cache=True).strftime('%H:%M:%S').tolist()
+    rows = list(zip(*cols.values()))
+    
+    upsert_rows(conn, rows, CREATE_STAGE_SQL, INSERT_STAGE_SQL, UPDATE_SQL, INSERT_SQL)
+
+def send_email(msg):
+    """Send a prepared email message over SMTP"""
     try:
-        print(f"\nProcessing {total_records} records...")
-        for index, record in enumerate(data, 1):
-            if index % 10 == 0:  # Show progress every 10 records
-                progress = (index / total_records) * 100
-                print(f"Progress: {progress:.1f}% ({index}/{total_records} records)", end='\r')
-            
-            sql = """
-            MERGE harvests AS target
-            USING (SELECT ? as id, ? as farm, ? as plot, ? as produce, 
-                          ? as worker, ? as unit, ? as harvest_date,
-                          ? as start_time, ? as end_time, ? as duration,
-                          ? as containers, ? as kgs_harvested) AS source
-            ON target.id = source.id
-            WHEN MATCHED THEN
-                UPDATE SET 
-                    farm = source.farm,
-                    plot = source.plot,
-                    produce = source.produce,
-                    worker = source.worker,
-                    unit = source.unit,
-                    harvest_date = source.harvest_date,
-                    start_time = source.start_time,
-                    end_time = source.end_time,
-                    duration = source.duration,
-                    containers = source.containers,
-                    kgs_harvested = source.kgs_harvested,
-                    insert_date = GETDATE()
-            WHEN NOT MATCHED THEN
-                INSERT (id, farm, plot, produce, worker, unit, 
-                       harvest_date, start_time, end_time, 
-                       duration, containers, kgs_harvested, insert_date)
-                VALUES (source.id, source.farm, source.plot, source.produce,
-                       source.worker, source.unit, source.harvest_date,
-                       source.start_time, source.end_time, source.duration,
-                       source.containers, source.kgs_harvested, GETDATE());
-            """
-            
-            # Convert string dates/times to proper format
-            harvest_date = datetime.strptime(record['harvest_date'], '%Y-%m-%d %H:%M:%S').strftime('%Y-%m-%d %H:%M:%S')
-            start_time = datetime.strptime(record['start_time'], '%H:%M').strftime('%H:%M:%S')
-            end_time = datetime.strptime(record['end_time'], '%H:%M').strftime('%H:%M:%S')
-            
-            cursor.execute(sql, (
-                record['id'],
-                record['farm'],
-                record['plot'],
-                record['produce'],
-                record['worker'],
-                record['unit'],
-                harvest_date,
-                start_time,
-                end_time,
-                record['duration'],
-                record['containers'],
-                record['kgs_harvested']
-            ))
-        
-        print("\nCommitting changes to database...")  # New line to clear the progress line
-        conn.commit()
-        print("✓ Database update completed successfully")
-        logging.info(f"Successfully processed {total_records} records")
+        with smtplib.SMTP(SMTP_SERVER, SMTP_PORT) as server:
+            server.starttls()
+            server.login(EMAIL_SENDER, EMAIL_PASSWORD)
+            server.send_message(msg)
+
+        logging.info("Email notification sent successfully")
     except Exception as e:
-        conn.rollback()
-        logging.error(f"Data insertion error: {str(e)}")
-        raise
-    finally:
-        cursor.close()
+        logging.error(f"Failed to send email notification: {str(e)}")
 
 def send_email_notification(success, start_date, end_date, error_message=None, records_processed=0):
     """Send email notification about sync status"""
@@ -189,81 +206,42 @@ def send_email_notification(success, start_date, end_date, error_message=None, r
 
         msg.attach(MIMEText(body, 'plain'))
 
-        with smtplib.SMTP(SMTP_SERVER, SMTP_PORT) as server:
-            server.starttls()
-            server.login(EMAIL_SENDER, EMAIL_PASSWORD)
-            server.send_message(msg)
-
-        logging.info("Email notification sent successfully")
+        # Deliver in the background so the SMTP handshake doesn't hold up the sync
+        EMAIL_EXECUTOR.submit(send_email, msg)
     except Exception as e:
         logging.error(f"Failed to send email notification: {str(e)}")
 
-def sync_data(start_date=None, end_date=None):
+def notify_sync_success(start_date, end_date, records_processed):
+    """Send the success email for a completed sync"""
+    send_email_notification(
+        success=True,
+        start_date=start_date,
+        end_date=end_date,
+        records_processed=records_processed
+    )
+
+def notify_sync_error(start_date, end_date, error_message, records_processed):
+    """Send the error email for a failed sync"""
+    send_email_notification(
+        success=False,
+        start_date=start_date,
+        end_date=end_date,
+        error_message=error_message,
+        records_processed=records_processed
+    )
+
+def sync_data(start_date=None, end_date=None, force=False):
     """Main function to sync data with optional date range"""
-    records_processed = 0
-    try:
-        # If no dates provided, use today's date
-        if start_date is None:
-            start_date = date.today()
-        if end_date is None:
-            end_date = date.today()
-            
-        print("\n=== Starting Data Sync Process ===")
-        print(f"Date range: {start_date} to {end_date}")
-        
-        # Fetch data from API
-        data = fetch_api_data(start_date, end_date)
-        records_processed = len(data)
-        
-        # Connect to database
-        print("\nConnecting to database...")
-        with get_database_connection() as conn:
-            print("✓ Database connection established")
-            # Insert data
-            insert_data(conn, data)
-            
-        print("\n=== Data Sync Process Completed ===")
-        logging.info(f"Data sync completed successfully for period {start_date} to {end_date}")
-        
-        # Send success email
-        send_email_notification(
-            success=True,
-            start_date=start_date,
-            end_date=end_date,
-            records_processed=records_processed
-        )
-    except Exception as e:
-        error_message = str(e)
-        print(f"\n✗ Error: Data sync failed: {error_message}")
-        logging.error(f"Data sync failed: {error_message}")
-        
-        # Send error email
-        send_email_notification(
-            success=False,
-            start_date=start_date,
-            end_date=end_date,
-            error_message=error_message,
-            records_processed=records_processed
-        )
+    run_sync(
+        'Harvest', fetch_api_data, insert_data, 'harvests', 'id', start_date, end_date,
+        force=force,
+        on_success=notify_sync_success,
+        on_error=notify_sync_error
+    )
 
 def main():
     """Main execution function"""
-    parser = argparse.ArgumentParser(description='Sync harvest data for a specific date range')
-    parser.add_argument('--start-date', type=str, help='Start date (YYYY-MM-DD)', default=None)
-    parser.add_argument('--end-date', type=str, help='End date (YYYY-MM-DD)', default=None)
-    
-    args = parser.parse_args()
-    
-    try:
-        start_date = datetime.strptime(args.start_date, '%Y-%m-%d').date() if args.start_date else None
-        end_date = datetime.strptime(args.end_date, '%Y-%m-%d').date() if args.end_date else None
-        
-        sync_data(start_date, end_date)
-    except ValueError as e:
-        logging.error(f"Invalid date format. Please use YYYY-MM-DD. Error: {str(e)}")
-        print("Invalid date format. Please use YYYY-MM-DD")
-    except Exception as e:
-        logging.error(f"Error in main: {str(e)}")
+    run_cli('Sync harvest data for a specific date range', sync_data)
 
 if __name__ == "__main__":
     main()